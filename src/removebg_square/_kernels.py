@@ -0,0 +1,32 @@
+from __future__ import annotations
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def _composite_on_white(canvas, rgba, x, y):
+    h, w = rgba.shape[0], rgba.shape[1]
+    for i in range(h):
+        for j in range(w):
+            a = int(rgba[i, j, 3])
+            if a == 0:
+                continue
+            if a == 255:
+                for c in range(3):
+                    canvas[y + i, x + j, c] = rgba[i, j, c]
+                continue
+            inv = 255 - a
+            for c in range(3):
+                canvas[y + i, x + j, c] = (
+                    int(rgba[i, j, c]) * a + int(canvas[y + i, x + j, c]) * inv + 127
+                ) // 255
+
+
+if njit is not None:
+    composite_on_white = njit(fastmath=True, cache=True)(_composite_on_white)
+else:
+    composite_on_white = None
@@ -1,23 +1,33 @@
 from __future__ import annotations
 
+import contextlib
+import functools
+import json
 import os
+import re
+import sys
 from pathlib import Path
-from typing import Optional, Tuple, Union, Any
+from types import MappingProxyType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Final,
+    Iterator,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import requests
-import typer
-from rich import print
+if TYPE_CHECKING:
+    import requests
 
 from uuid import uuid4
+import atexit
+import threading
 import time
 
-from .core import process_folder, ProcessResult
-
-app = typer.Typer(
-    add_completion=False,
-    help="Batch remove.bg + padded-canvas formatter.",
-)
-
 KEYRING_SERVICE = "removebg-square-cli"
 KEYRING_USERNAME = "removebg_api_key"
 
@@ -25,14 +35,75 @@ TRACKRING_SERVICE = "removebg-square-tracker"
 TRACK_HF_USERNAME = "hf_access_token"
 TRACK_TOKEN_USERNAME = "tracker_token"
 
+_OUT_EXT: Final = ".jpg"
+OUT_EXTS: Final = (".jpg", ".jpeg", ".png", ".webp")
+_XMP_TOOL: Final = "removebg-square-cli"
+
 TRACK_ENDPOINT = os.environ.get(
     "REMOVEBG_SQUARE_TRACK_ENDPOINT",
     "https://sofiakris-bgremoval.hf.space/track",
 )
 
+TRACK_JOIN_TIMEOUT_S = 12.0
+
+_XDG_CACHE_HOME = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+CACHE_DIR = Path(_XDG_CACHE_HOME) / "removebg-square"
+RESULT_CACHE_DIR = CACHE_DIR / "results"
+TRACK_PENDING_PATH = CACHE_DIR / "pending_runs.jsonl"
+TRACK_PENDING_LOCK_PATH = CACHE_DIR / "pending_runs.lock"
+TRACK_FLUSH_LOCK_PATH = CACHE_DIR / "pending_runs.flush.lock"
+TRACK_PENDING_MAX_RUNS = 100
+TRACK_BATCH_RUNS = max(1, int(os.environ.get("REMOVEBG_SQUARE_TRACK_BATCH", "5")))
+TRACK_BATCH_MAX_AGE_S = 3600.0
+
 TRACKING_ENABLED = os.environ.get("REMOVEBG_SQUARE_TRACKING", "1").strip() != "0"
 
+_ENV_HF_TOKEN = os.environ.get("HF_ACCESS_TOKEN", "").strip() or None
+_ENV_TRACKER_TOKEN = os.environ.get("TRACKER_TOKEN", "").strip() or None
+
+
+def print(*objects: Any, **kwargs: Any) -> None:
+    from rich import print as rich_print
+
+    rich_print(*objects, **kwargs)
+
+
+_ANSI_TAGS: Final = {
+    "[green]": "\x1b[32m",
+    "[/green]": "\x1b[39m",
+    "[yellow]": "\x1b[33m",
+    "[/yellow]": "\x1b[39m",
+    "[cyan]": "\x1b[36m",
+    "[/cyan]": "\x1b[39m",
+}
+
+
+def _say(msg: str) -> None:
+    color = sys.stdout.isatty() and "NO_COLOR" not in os.environ
+    for tag, code in _ANSI_TAGS.items():
+        msg = msg.replace(tag, code if color else "")
+    sys.stdout.write(msg + "\n")
 
+
+def _bad_parameter(message: str) -> Exception:
+    import typer
+
+    return typer.BadParameter(message)
+
+
+def _exit(code: int) -> Exception:
+    import typer
+
+    return typer.Exit(code=code)
+
+
+def _prompt(text: str, **kwargs: Any) -> Any:
+    import typer
+
+    return typer.prompt(text, **kwargs)
+
+
+@functools.lru_cache(maxsize=16)
 def _get_key_from_keyring(service: str, username: str) -> Optional[str]:
     try:
         import keyring
@@ -47,12 +118,14 @@ def _get_key_from_keyring(service: str, username: str) -> Optional[str]:
 def _set_key_in_keyring(service: str, username: str, value: str) -> None:
     import keyring
 
+    _get_key_from_keyring.cache_clear()
     keyring.set_password(service, username, value)
 
 
 def _delete_key_in_keyring(service: str, username: str) -> None:
     import keyring
 
+    _get_key_from_keyring.cache_clear()
     try:
         keyring.delete_password(service, username)
     except Exception:
@@ -79,11 +152,8 @@ def _resolve_tracking_tokens(use_keyring: bool) -> tuple[Optional[str], Optional
     if not TRACKING_ENABLED:
         return None, None
 
-    env_hf = os.environ.get("HF_ACCESS_TOKEN")
-    env_tracker = os.environ.get("TRACKER_TOKEN")
-
-    hf = env_hf.strip() if env_hf else None
-    tr = env_tracker.strip() if env_tracker else None
+    hf = _ENV_HF_TOKEN
+    tr = _ENV_TRACKER_TOKEN
 
     if use_keyring:
         if not hf:
@@ -93,7 +163,7 @@ def _resolve_tracking_tokens(use_keyring: bool) -> tuple[Optional[str], Optional
 
     if not hf:
         print("[yellow][TRACK][/yellow] Hugging Face token not found.")
-        hf = typer.prompt(
+        hf = _prompt(
             "Paste Hugging Face access token (hf_...)", hide_input=True
         ).strip()
         try:
@@ -107,7 +177,7 @@ def _resolve_tracking_tokens(use_keyring: bool) -> tuple[Optional[str], Optional
 
     if not tr:
         print("[yellow][TRACK][/yellow] Tracker token not found.")
-        tr = typer.prompt("Paste tracker token (hex/random)", hide_input=True).strip()
+        tr = _prompt("Paste tracker token (hex/random)", hide_input=True).strip()
         try:
             if use_keyring and tr:
                 _set_key_in_keyring(TRACKRING_SERVICE, TRACK_TOKEN_USERNAME, tr)
@@ -124,6 +194,31 @@ def _resolve_tracking_tokens(use_keyring: bool) -> tuple[Optional[str], Optional
     return hf, tr
 
 
+@functools.lru_cache(maxsize=None)
+def _json_encoder() -> Callable[[Any], bytes]:
+    try:
+        import orjson
+    except ImportError:
+        return lambda obj: json.dumps(obj).encode("utf-8")
+    return orjson.dumps
+
+
+_TRACK_SESSION: Optional[requests.Session] = None
+
+
+def _get_track_session() -> requests.Session:
+    global _TRACK_SESSION
+    if _TRACK_SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.headers.update({"Content-Type": "application/json"})
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        _TRACK_SESSION = session
+    return _TRACK_SESSION
+
+
 def _post_run(
     hf_token: str,
     tracker_token: str,
@@ -135,7 +230,7 @@ def _post_run(
     unprocessed_files: list[dict[str, Any]],
     elapsed_s: float,
     tool: str,
-) -> None:
+) -> bool:
     payload: dict[str, Any] = {
         "run_id": run_id,
         "tool": tool,
@@ -147,14 +242,13 @@ def _post_run(
     }
 
     try:
-        resp = requests.post(
+        resp = _get_track_session().post(
             TRACK_ENDPOINT,
             headers={
                 "Authorization": f"Bearer {hf_token}",
                 "X-Tracker-Token": tracker_token,
-                "Content-Type": "application/json",
             },
-            json=payload,
+            data=_json_encoder()(payload),
             timeout=12,
         )
 
@@ -164,101 +258,201 @@ def _post_run(
                 f"processed={processed}, unprocessed={unprocessed}, "
                 f"files={len(processed_files) + len(unprocessed_files)}"
             )
-            return
+            return True
 
         body = (resp.text or "")[:800].strip()
         print(f"[yellow][TRACK][/yellow] failed ({resp.status_code}): {body}")
     except Exception as e:
         print(f"[yellow][TRACK][/yellow] failed: {type(e).__name__}: {e}")
+    return False
 
 
-@app.command()
-def login(
-    api_key: str = typer.Option(..., "--api-key", help="Your remove.bg API key."),
-):
-    try:
-        _set_key_in_keyring(KEYRING_SERVICE, KEYRING_USERNAME, api_key)
-    except ModuleNotFoundError:
-        raise typer.Exit(code=2)
-    print("[green]Saved remove.bg API key to Keychain.[/green]")
+_TRACK_LOCK = threading.Lock()
+_TRACK_WORKER: Optional[threading.Thread] = None
+
+
+@contextlib.contextmanager
+def _file_lock(path: Path, blocking: bool = True) -> Iterator[bool]:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+
+            f.seek(0)
+            try:
+                msvcrt.locking(
+                    f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1
+                )
+            except OSError:
+                if blocking:
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
 
 
-@app.command()
-def logout():
+@contextlib.contextmanager
+def _pending_runs_lock() -> Iterator[None]:
+    with _TRACK_LOCK, _file_lock(TRACK_PENDING_LOCK_PATH):
+        yield
+
+
+def _load_pending_runs() -> list[dict[str, Any]]:
     try:
-        _delete_key_in_keyring(KEYRING_SERVICE, KEYRING_USERNAME)
-    except ModuleNotFoundError:
-        raise typer.Exit(code=2)
-    print("[yellow]Removed remove.bg API key from Keychain (if it existed).[/yellow]")
-
-
-@app.command()
-def tracker_login(
-    hf_token: str = typer.Option(
-        ..., "--hf-token", help="Hugging Face access token (hf_...)."
-    ),
-    tracker_token: str = typer.Option(
-        ..., "--tracker-token", help="Tracker token (hex/random)."
-    ),
-):
+        lines = TRACK_PENDING_PATH.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    runs: list[dict[str, Any]] = []
+    for line in lines:
+        try:
+            runs.append(json.loads(line))
+        except ValueError:
+            continue
+    return runs
+
+
+def _save_pending_runs(runs: list[dict[str, Any]]) -> None:
+    if not runs:
+        TRACK_PENDING_PATH.unlink(missing_ok=True)
+        return
+    TRACK_PENDING_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp = TRACK_PENDING_PATH.with_name(f"{TRACK_PENDING_PATH.name}.{os.getpid()}.tmp")
+    dumps = _json_encoder()
+    tmp.write_bytes(b"".join(dumps(r) + b"\n" for r in runs))
+    tmp.replace(TRACK_PENDING_PATH)
+
+
+def _append_pending_run(**run: Any) -> list[dict[str, Any]]:
+    runs: list[dict[str, Any]] = []
     try:
-        _set_key_in_keyring(TRACKRING_SERVICE, TRACK_HF_USERNAME, hf_token)
-        _set_key_in_keyring(TRACKRING_SERVICE, TRACK_TOKEN_USERNAME, tracker_token)
-    except ModuleNotFoundError:
-        raise typer.Exit(code=2)
-    print("[green]Saved tracking tokens to Keychain.[/green]")
+        with _pending_runs_lock():
+            runs = _load_pending_runs()
+            runs.append({"queued_at": time.time(), "run": run})
+            del runs[:-TRACK_PENDING_MAX_RUNS]
+            _save_pending_runs(runs)
+    except OSError as e:
+        print(f"[yellow][TRACK][/yellow] could not queue run: {e}")
+    return runs
+
+
+def _drop_pending_run(run_id: str) -> None:
+    with _pending_runs_lock():
+        runs = _load_pending_runs()
+        _save_pending_runs([r for r in runs if r["run"].get("run_id") != run_id])
+
+
+def _pending_runs_due(runs: list[dict[str, Any]]) -> bool:
+    if not runs:
+        return False
+    oldest = min(float(r.get("queued_at", 0.0)) for r in runs)
+    return (
+        len(runs) >= TRACK_BATCH_RUNS or time.time() - oldest >= TRACK_BATCH_MAX_AGE_S
+    )
 
 
-@app.command()
-def tracker_logout():
+def _send_pending_runs(hf_token: str, tracker_token: str) -> tuple[int, int]:
+    runs: list[dict[str, Any]] = []
+    sent = 0
     try:
-        _delete_key_in_keyring(TRACKRING_SERVICE, TRACK_HF_USERNAME)
-        _delete_key_in_keyring(TRACKRING_SERVICE, TRACK_TOKEN_USERNAME)
-    except ModuleNotFoundError:
-        raise typer.Exit(code=2)
-    print("[yellow]Removed tracking tokens from Keychain (if they existed).[/yellow]")
+        with _file_lock(TRACK_FLUSH_LOCK_PATH, blocking=False) as acquired:
+            with _pending_runs_lock():
+                runs = _load_pending_runs()
+            if not acquired:
+                print("[dim][TRACK][/dim] another process is sending pending runs.")
+                return 0, len(runs)
+            for r in runs:
+                if _post_run(hf_token, tracker_token, **r["run"]):
+                    _drop_pending_run(r["run"]["run_id"])
+                    sent += 1
+    except OSError as e:
+        print(f"[yellow][TRACK][/yellow] could not update pending runs: {e}")
+    return sent, len(runs) - sent
+
+
+def _queue_flush(hf_token: str, tracker_token: str) -> None:
+    global _TRACK_WORKER
+    if _TRACK_WORKER is not None and _TRACK_WORKER.is_alive():
+        return
+    _TRACK_WORKER = threading.Thread(
+        target=_send_pending_runs,
+        args=(hf_token, tracker_token),
+        name="track-post",
+        daemon=True,
+    )
+    _TRACK_WORKER.start()
+
+
+def _flush_track_queue() -> None:
+    worker = _TRACK_WORKER
+    if worker is not None:
+        worker.join(TRACK_JOIN_TIMEOUT_S)
+
+
+atexit.register(_flush_track_queue)
 
 
 Size = Union[int, Tuple[int, int]]
 
-PRESETS: dict[str, dict[str, object]] = {
-    "square": {"size": (1000, 1000), "margins": (111, 111, 111, 111)},
-    "square-xl": {"size": (1400, 1400), "margins": (155, 155, 155, 155)},
-    "landscape": {
-        "size": (1920, 1080),
-        "margins": (120, 120, 120, 120),
-    },
-    "portrait": {
-        "size": (1080, 1920),
-        "margins": (120, 120, 120, 120),
-    },
-}
+PRESETS: Mapping[str, tuple[tuple[int, int], tuple[int, int, int, int]]] = (
+    MappingProxyType(
+        {
+            "square": ((1000, 1000), (111, 111, 111, 111)),
+            "square-xl": ((1400, 1400), (155, 155, 155, 155)),
+            "landscape": ((1920, 1080), (120, 120, 120, 120)),
+            "portrait": ((1080, 1920), (120, 120, 120, 120)),
+        }
+    )
+)
+
+_SIZE_RE: Final = re.compile(r"([+-]?\d+)\s*(?:x\s*([+-]?\d+))?")
 
 
 def parse_out_size(value: str) -> Size:
     s = (value or "").strip().lower()
     if not s:
-        raise typer.BadParameter("out-size cannot be empty")
+        raise _bad_parameter("out-size cannot be empty")
 
-    if "x" in s:
-        w_str, h_str = s.split("x", 1)
-        try:
-            w, h = int(w_str.strip()), int(h_str.strip())
-        except ValueError:
-            raise typer.BadParameter('out-size must look like "1000" or "1000x1000"')
+    m = _SIZE_RE.fullmatch(s)
+    if m is None:
+        raise _bad_parameter('out-size must look like "1000" or "1000x1000"')
+
+    w_str, h_str = m.groups()
+    if h_str is not None:
+        w, h = int(w_str), int(h_str)
         if w < 1 or h < 1:
-            raise typer.BadParameter("out-size width/height must be >= 1")
+            raise _bad_parameter("out-size width/height must be >= 1")
         return (w, h)
 
-    try:
-        n = int(s)
-    except ValueError:
-        raise typer.BadParameter('out-size must look like "1000" or "1000x1000"')
+    n = int(w_str)
     if n < 1:
-        raise typer.BadParameter("out-size must be >= 1")
+        raise _bad_parameter("out-size must be >= 1")
     return n
 
 
+def parse_out_ext(value: str) -> str:
+    ext = (value or "").strip().lower()
+    if ext and not ext.startswith("."):
+        ext = "." + ext
+    if ext not in OUT_EXTS:
+        raise _bad_parameter(f"out-ext must be one of: {', '.join(OUT_EXTS)}")
+    return ext
+
+
 def _size_to_wh(size: Size) -> tuple[int, int]:
     if isinstance(size, int):
         return size, size
@@ -291,7 +485,7 @@ def resolve_size_and_margins(
         v is not None for v in (margin_left, margin_right, margin_top, margin_bottom)
     )
     if user_set_any and not user_set_all:
-        raise typer.BadParameter(
+        raise _bad_parameter(
             "If you set any margin, you must set all four: "
             "--margin-left/--margin-right/--margin-top/--margin-bottom"
         )
@@ -300,11 +494,9 @@ def resolve_size_and_margins(
         key = preset.strip().lower()
         if key not in PRESETS:
             valid = ", ".join(PRESETS.keys())
-            raise typer.BadParameter(
-                f"Unknown preset '{preset}'. Valid presets: {valid}"
-            )
+            raise _bad_parameter(f"Unknown preset '{preset}'. Valid presets: {valid}")
 
-        size = PRESETS[key]["size"]
+        size, preset_margins = PRESETS[key]
         if user_set_all:
             ml, mr, mt, mb = (
                 int(margin_left),
@@ -313,7 +505,7 @@ def resolve_size_and_margins(
                 int(margin_bottom),
             )
         else:
-            ml, mr, mt, mb = PRESETS[key]["margins"]
+            ml, mr, mt, mb = preset_margins
         return size, int(ml), int(mr), int(mt), int(mb)
 
     size = parse_out_size(out_size)
@@ -343,23 +535,28 @@ def run_impl(
     use_keyring: bool = True,
     embed_xmp: bool = True,
     xmp_sidecar: bool = False,
+    workers: int = 8,
+    keep_tmp: bool = False,
+    out_ext: str = _OUT_EXT,
+    cache_results: bool = False,
 ) -> None:
-    hf_token, tracker_token = _resolve_tracking_tokens(use_keyring=use_keyring)
+    from .core import process_folder, ProcessResult
 
     key = resolve_api_key(api_key, use_keyring=use_keyring)
     if not key:
         print("[yellow]No remove.bg API key found.[/yellow]")
-        api_key = typer.prompt(
+        api_key = _prompt(
             "Paste your remove.bg API key (this will be saved securely)",
             hide_input=True,
         )
         try:
             _set_key_in_keyring(KEYRING_SERVICE, KEYRING_USERNAME, api_key)
+            os.environ["REMOVEBG_API_KEY"] = api_key
             print("[green]API key saved. You won’t be asked again.[/green]")
             key = api_key
         except Exception:
             print("[red]Could not save key automatically.[/red]")
-            raise typer.Exit(code=2)
+            raise _exit(code=2)
 
     run_id = str(uuid4())
     t0 = time.time()
@@ -374,142 +571,194 @@ def run_impl(
         margin_top=margin_top,
         margin_bottom=margin_bottom,
         remove_size=remove_size,
-        out_ext=".jpg",
-        xmp_tool="removebg-square-cli",
+        out_ext=out_ext,
+        xmp_tool=_XMP_TOOL,
         embed_png_xmp=embed_xmp,
         also_write_xmp_sidecar=xmp_sidecar,
         run_id=run_id,
+        max_workers=workers,
+        keep_tmp=keep_tmp,
+        cache_dir=RESULT_CACHE_DIR if cache_results else None,
     )
+    elapsed_s = time.time() - t0
 
     if result.processed == 0 and result.unprocessed == 0:
-        print(f"[yellow]No images found in:[/yellow] {input_dir.resolve()}")
-        raise typer.Exit(code=1)
+        _say(f"[yellow]No images found in:[/yellow] {input_dir.resolve()}")
+        raise _exit(code=1)
 
-    print(
+    _say(
         f"[green]Done.[/green] Wrote {len(result.written)} file(s) to {output_dir.resolve()}"
     )
-    print(
+    _say(
         f"[cyan]Counts:[/cyan] processed={result.processed}, unprocessed={result.unprocessed}"
     )
+    sys.stdout.flush()
+
+    if result.processed == 0 or not TRACKING_ENABLED:
+        return
+
+    pending = _append_pending_run(
+        run_id=run_id,
+        processed=result.processed,
+        unprocessed=result.unprocessed,
+        processed_files=result.processed_files,
+        unprocessed_files=result.unprocessed_files,
+        elapsed_s=elapsed_s,
+        tool=_XMP_TOOL,
+    )
+    if not _pending_runs_due(pending):
+        return
 
+    hf_token, tracker_token = _resolve_tracking_tokens(use_keyring=use_keyring)
     if hf_token and tracker_token:
-        _post_run(
-            hf_token,
-            tracker_token,
-            run_id=run_id,
-            processed=result.processed,
-            unprocessed=result.unprocessed,
-            processed_files=result.processed_files,
-            unprocessed_files=result.unprocessed_files,
-            elapsed_s=(time.time() - t0),
-            tool="removebg-square-cli",
-        )
+        _queue_flush(hf_token, tracker_token)
 
 
-@app.command()
-def run(
-    input_dir: Path = typer.Option(
-        Path("input"),
-        "--input-dir",
-        "-i",
-        exists=False,
-        file_okay=False,
-        dir_okay=True,
-    ),
-    output_dir: Path = typer.Option(
-        Path("output"),
-        "--output-dir",
-        "-o",
-        exists=False,
-        file_okay=False,
-        dir_okay=True,
-    ),
-    preset: Optional[str] = typer.Option(
-        None,
-        "--preset",
-        help="Size preset: square, square-xl, landscape, portrait",
-    ),
-    out_size: str = typer.Option(
-        "1000x1000",
-        "--out-size",
-        help='Manual canvas size: "1000" or "WxH" like "1920x1080". Ignored if --preset is set.',
-    ),
-    margin_left: Optional[int] = typer.Option(
-        None,
-        "--margin-left",
-        min=0,
-        help="Left margin (set all four to override defaults).",
-    ),
-    margin_right: Optional[int] = typer.Option(
-        None,
-        "--margin-right",
-        min=0,
-        help="Right margin (set all four to override defaults).",
-    ),
-    margin_top: Optional[int] = typer.Option(
-        None,
-        "--margin-top",
-        min=0,
-        help="Top margin (set all four to override defaults).",
-    ),
-    margin_bottom: Optional[int] = typer.Option(
-        None,
-        "--margin-bottom",
-        min=0,
-        help="Bottom margin (set all four to override defaults).",
-    ),
-    remove_size: str = typer.Option(
-        "auto",
-        "--remove-size",
-        help='remove.bg "size" param, e.g. auto, preview, full.',
-    ),
-    api_key: Optional[str] = typer.Option(
-        None,
-        "--api-key",
-        help="remove.bg API key (overrides env/keychain).",
-    ),
-    use_keyring: bool = typer.Option(
-        True,
-        "--use-keyring/--no-keyring",
-        help="Allow using Keychain if available.",
-    ),
-    embed_xmp: bool = typer.Option(
-        True,
-        "--embed-xmp/--no-embed-xmp",
-        help="Embed XMP into output PNG via iTXt XML:com.adobe.xmp.",
-    ),
-    xmp_sidecar: bool = typer.Option(
-        False,
-        "--xmp-sidecar/--no-xmp-sidecar",
-        help="Also write a .png.xmp sidecar file.",
-    ),
-):
-    resolved_size, ml, mr, mt, mb = resolve_size_and_margins(
-        preset=preset,
-        out_size=out_size,
-        margin_left=margin_left,
-        margin_right=margin_right,
-        margin_top=margin_top,
-        margin_bottom=margin_bottom,
-    )
+def _dir_option(value: str) -> Path:
+    path = Path(value)
+    if path.exists() and not path.is_dir():
+        raise ValueError(f"{value} is not a directory")
+    return path
 
-    run_impl(
-        input_dir=input_dir,
-        output_dir=output_dir,
-        out_size=resolved_size,
+
+def _margin_option(value: str) -> int:
+    n = int(value)
+    if n < 0:
+        raise ValueError(f"{value} is below 0")
+    return n
+
+
+def _workers_option(value: str) -> int:
+    n = int(value)
+    if n < 1:
+        raise ValueError(f"{value} is below 1")
+    return n
+
+
+_RunOpt = Tuple[Tuple[str, ...], str, Optional[str], Callable[[str], Any]]
+
+_RUN_OPTS: tuple[_RunOpt, ...] = (
+    (("-i", "--input-dir"), "input_dir", "input", _dir_option),
+    (("-o", "--output-dir"), "output_dir", "output", _dir_option),
+    (("--preset",), "preset", None, str),
+    (("--out-size",), "out_size", "1000x1000", str),
+    (("--margin-left",), "margin_left", None, _margin_option),
+    (("--margin-right",), "margin_right", None, _margin_option),
+    (("--margin-top",), "margin_top", None, _margin_option),
+    (("--margin-bottom",), "margin_bottom", None, _margin_option),
+    (("--remove-size",), "remove_size", "auto", str),
+    (("--api-key",), "api_key", None, str),
+    (("--workers",), "workers", "8", _workers_option),
+    (("--out-ext",), "out_ext", _OUT_EXT, parse_out_ext),
+)
+
+_RUN_SWITCHES: dict[str, tuple[str, bool]] = {
+    "--use-keyring": ("use_keyring", True),
+    "--no-keyring": ("use_keyring", False),
+    "--embed-xmp": ("embed_xmp", True),
+    "--no-embed-xmp": ("embed_xmp", False),
+    "--xmp-sidecar": ("xmp_sidecar", True),
+    "--no-xmp-sidecar": ("xmp_sidecar", False),
+    "--debug-keep-tmp": ("keep_tmp", True),
+    "--cache-results": ("cache_results", True),
+    "--no-cache-results": ("cache_results", False),
+}
+
+_RUN_OPT_DEST: dict[str, str] = {
+    flag: dest for flags, dest, _, _ in _RUN_OPTS for flag in flags
+}
+
+_RUN_DEFAULTS: dict[str, Any] = {
+    **{dest: default for _, dest, default, _ in _RUN_OPTS},
+    "use_keyring": True,
+    "embed_xmp": True,
+    "xmp_sidecar": False,
+    "keep_tmp": False,
+    "cache_results": False,
+}
+
+
+def _parse_run_args(args: list[str]) -> Optional[dict[str, Any]]:
+    parsed = dict(_RUN_DEFAULTS)
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        switch = _RUN_SWITCHES.get(arg)
+        if switch is not None:
+            parsed[switch[0]] = switch[1]
+            i += 1
+            continue
+
+        name, sep, value = arg.partition("=")
+        dest = _RUN_OPT_DEST.get(name)
+        if dest is None or (sep and not name.startswith("--")):
+            return None
+        if not sep:
+            i += 1
+            if i >= len(args):
+                return None
+            value = args[i]
+        parsed[dest] = value
+        i += 1
+
+    try:
+        for _, dest, _, cast in _RUN_OPTS:
+            if parsed[dest] is not None:
+                parsed[dest] = cast(parsed[dest])
+
+        size, ml, mr, mt, mb = resolve_size_and_margins(
+            preset=parsed.pop("preset"),
+            out_size=parsed["out_size"],
+            margin_left=parsed["margin_left"],
+            margin_right=parsed["margin_right"],
+            margin_top=parsed["margin_top"],
+            margin_bottom=parsed["margin_bottom"],
+        )
+    except Exception:
+        return None
+
+    parsed.update(
+        out_size=size,
         margin_left=ml,
         margin_right=mr,
         margin_top=mt,
         margin_bottom=mb,
-        remove_size=remove_size,
-        api_key=api_key,
-        use_keyring=use_keyring,
-        embed_xmp=embed_xmp,
-        xmp_sidecar=xmp_sidecar,
     )
+    return parsed
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    kwargs: Optional[dict[str, Any]] = {}
+    if args:
+        kwargs = _parse_run_args(args[1:]) if args[0] == "run" else None
+
+    if kwargs is None:
+        from .cli_typer import app
+
+        app()
+        return
+
+    try:
+        run_impl(**kwargs)
+    except (EOFError, KeyboardInterrupt):
+        sys.stderr.write("\nAborted!\n")
+        sys.exit(1)
+    except Exception as e:
+        import typer
+
+        if isinstance(e, typer.Abort):
+            sys.stderr.write("Aborted!\n")
+            sys.exit(1)
+        if isinstance(e, typer.Exit):
+            sys.exit(e.exit_code)
+        raise
+
 
+def __getattr__(name: str) -> Any:
+    if name == "app":
+        from .cli_typer import app
 
-@app.callback(invoke_without_command=True)
-def _default(ctx: typer.Context):
-    if ctx.invoked_subcommand is None:
-        run_impl()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
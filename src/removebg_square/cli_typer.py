@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Final, Optional
+
+import typer
+
+from .cli import (
+    KEYRING_SERVICE,
+    KEYRING_USERNAME,
+    OUT_EXTS,
+    TRACK_HF_USERNAME,
+    TRACK_TOKEN_USERNAME,
+    TRACKRING_SERVICE,
+    _OUT_EXT,
+    _delete_key_in_keyring,
+    _load_pending_runs,
+    _resolve_tracking_tokens,
+    _send_pending_runs,
+    _set_key_in_keyring,
+    parse_out_ext,
+    print,
+    resolve_size_and_margins,
+    run_impl,
+)
+
+_HELP: Final = {
+    "login_api_key": "Your remove.bg API key.",
+    "hf_token": "Hugging Face access token (hf_...).",
+    "tracker_token": "Tracker token (hex/random).",
+    "preset": "Size preset: square, square-xl, landscape, portrait",
+    "out_size": 'Manual canvas size: "1000" or "WxH" like "1920x1080". Ignored if --preset is set.',
+    "margin_left": "Left margin (set all four to override defaults).",
+    "margin_right": "Right margin (set all four to override defaults).",
+    "margin_top": "Top margin (set all four to override defaults).",
+    "margin_bottom": "Bottom margin (set all four to override defaults).",
+    "remove_size": 'remove.bg "size" param, e.g. auto, preview, full.',
+    "api_key": "remove.bg API key (overrides env/keychain).",
+    "use_keyring": "Allow using Keychain if available.",
+    "embed_xmp": "Embed XMP into output PNG via iTXt XML:com.adobe.xmp.",
+    "xmp_sidecar": "Also write a .png.xmp sidecar file.",
+    "workers": "Number of concurrent remove.bg uploads.",
+    "out_ext": f"Output file type: {', '.join(OUT_EXTS)}.",
+    "keep_tmp": "Keep upload and remove.bg intermediates in output/_tmp_removebg.",
+    "cache_results": "Reuse remove.bg results for unchanged inputs (~/.cache/removebg-square).",
+    "flush_use_keyring": "Allow reading tracking tokens from Keychain.",
+}
+
+app = typer.Typer(
+    add_completion=False,
+    help="Batch remove.bg + padded-canvas formatter.",
+)
+
+
+@app.command()
+def login(
+    api_key: str = typer.Option(..., "--api-key", help=_HELP["login_api_key"]),
+):
+    try:
+        _set_key_in_keyring(KEYRING_SERVICE, KEYRING_USERNAME, api_key)
+    except ModuleNotFoundError:
+        raise typer.Exit(code=2)
+    print("[green]Saved remove.bg API key to Keychain.[/green]")
+
+
+@app.command()
+def logout():
+    try:
+        _delete_key_in_keyring(KEYRING_SERVICE, KEYRING_USERNAME)
+    except ModuleNotFoundError:
+        raise typer.Exit(code=2)
+    print("[yellow]Removed remove.bg API key from Keychain (if it existed).[/yellow]")
+
+
+@app.command()
+def tracker_login(
+    hf_token: str = typer.Option(..., "--hf-token", help=_HELP["hf_token"]),
+    tracker_token: str = typer.Option(
+        ..., "--tracker-token", help=_HELP["tracker_token"]
+    ),
+):
+    try:
+        _set_key_in_keyring(TRACKRING_SERVICE, TRACK_HF_USERNAME, hf_token)
+        _set_key_in_keyring(TRACKRING_SERVICE, TRACK_TOKEN_USERNAME, tracker_token)
+    except ModuleNotFoundError:
+        raise typer.Exit(code=2)
+    print("[green]Saved tracking tokens to Keychain.[/green]")
+
+
+@app.command()
+def tracker_logout():
+    try:
+        _delete_key_in_keyring(TRACKRING_SERVICE, TRACK_HF_USERNAME)
+        _delete_key_in_keyring(TRACKRING_SERVICE, TRACK_TOKEN_USERNAME)
+    except ModuleNotFoundError:
+        raise typer.Exit(code=2)
+    print("[yellow]Removed tracking tokens from Keychain (if they existed).[/yellow]")
+
+
+@app.command()
+def flush_telemetry(
+    use_keyring: bool = typer.Option(
+        True,
+        "--use-keyring/--no-keyring",
+        help=_HELP["flush_use_keyring"],
+    ),
+):
+    if not _load_pending_runs():
+        print("[green][TRACK][/green] No pending runs.")
+        return
+    hf_token, tracker_token = _resolve_tracking_tokens(use_keyring=use_keyring)
+    if not hf_token or not tracker_token:
+        raise typer.Exit(code=1)
+    sent, unsent = _send_pending_runs(hf_token, tracker_token)
+    print(f"[cyan][TRACK][/cyan] sent={sent}, pending={unsent}")
+    if unsent:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def run(
+    input_dir: Path = typer.Option(
+        Path("input"),
+        "--input-dir",
+        "-i",
+        exists=False,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    output_dir: Path = typer.Option(
+        Path("output"),
+        "--output-dir",
+        "-o",
+        exists=False,
+        file_okay=False,
+        dir_okay=True,
+    ),
+    preset: Optional[str] = typer.Option(
+        None,
+        "--preset",
+        help=_HELP["preset"],
+    ),
+    out_size: str = typer.Option(
+        "1000x1000",
+        "--out-size",
+        help=_HELP["out_size"],
+    ),
+    margin_left: Optional[int] = typer.Option(
+        None,
+        "--margin-left",
+        min=0,
+        help=_HELP["margin_left"],
+    ),
+    margin_right: Optional[int] = typer.Option(
+        None,
+        "--margin-right",
+        min=0,
+        help=_HELP["margin_right"],
+    ),
+    margin_top: Optional[int] = typer.Option(
+        None,
+        "--margin-top",
+        min=0,
+        help=_HELP["margin_top"],
+    ),
+    margin_bottom: Optional[int] = typer.Option(
+        None,
+        "--margin-bottom",
+        min=0,
+        help=_HELP["margin_bottom"],
+    ),
+    remove_size: str = typer.Option(
+        "auto",
+        "--remove-size",
+        help=_HELP["remove_size"],
+    ),
+    api_key: Optional[str] = typer.Option(
+        None,
+        "--api-key",
+        help=_HELP["api_key"],
+    ),
+    use_keyring: bool = typer.Option(
+        True,
+        "--use-keyring/--no-keyring",
+        help=_HELP["use_keyring"],
+    ),
+    embed_xmp: bool = typer.Option(
+        True,
+        "--embed-xmp/--no-embed-xmp",
+        help=_HELP["embed_xmp"],
+    ),
+    xmp_sidecar: bool = typer.Option(
+        False,
+        "--xmp-sidecar/--no-xmp-sidecar",
+        help=_HELP["xmp_sidecar"],
+    ),
+    workers: int = typer.Option(
+        8,
+        "--workers",
+        min=1,
+        help=_HELP["workers"],
+    ),
+    out_ext: str = typer.Option(
+        _OUT_EXT,
+        "--out-ext",
+        help=_HELP["out_ext"],
+    ),
+    keep_tmp: bool = typer.Option(
+        False,
+        "--debug-keep-tmp",
+        help=_HELP["keep_tmp"],
+    ),
+    cache_results: bool = typer.Option(
+        False,
+        "--cache-results/--no-cache-results",
+        help=_HELP["cache_results"],
+    ),
+):
+    resolved_size, ml, mr, mt, mb = resolve_size_and_margins(
+        preset=preset,
+        out_size=out_size,
+        margin_left=margin_left,
+        margin_right=margin_right,
+        margin_top=margin_top,
+        margin_bottom=margin_bottom,
+    )
+
+    run_impl(
+        input_dir=input_dir,
+        output_dir=output_dir,
+        out_size=resolved_size,
+        margin_left=ml,
+        margin_right=mr,
+        margin_top=mt,
+        margin_bottom=mb,
+        remove_size=remove_size,
+        api_key=api_key,
+        use_keyring=use_keyring,
+        embed_xmp=embed_xmp,
+        xmp_sidecar=xmp_sidecar,
+        workers=workers,
+        keep_tmp=keep_tmp,
+        out_ext=parse_out_ext(out_ext),
+        cache_results=cache_results,
+    )
+
+
+@app.callback(invoke_without_command=True)
+def _default(ctx: typer.Context):
+    if ctx.invoked_subcommand is None:
+        run_impl()
@@ -1,18 +1,26 @@
 from __future__ import annotations
 
+import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Tuple, Union, Any
+from typing import TYPE_CHECKING, Optional, Tuple, Union, Any
 
-import numpy as np
-import rawpy
-import requests
+import functools
+import hashlib
+import io
+import queue
+import sys
 import time
 import shutil
-from PIL import Image
+import threading
 
 from removebg_square.xmp import write_processed_tags
 
+if TYPE_CHECKING:
+    import numpy as np
+    import requests
+    from PIL import Image
+
 
 @dataclass
 class ProcessResult:
@@ -28,17 +36,149 @@ def pil_to_rgba(pil_img: Image.Image) -> Image.Image:
     return pil_img if pil_img.mode == "RGBA" else pil_img.convert("RGBA")
 
 
-def find_nontransparent_bbox(alpha: np.ndarray):
-    ys, xs = np.where(alpha > 0)
-    if xs.size == 0 or ys.size == 0:
-        return None
-    x0, x1 = int(xs.min()), int(xs.max())
-    y0, y1 = int(ys.min()), int(ys.max())
+def _alpha_threshold_from_env() -> int:
+    try:
+        return min(255, max(0, int(os.environ.get("REMOVEBG_ALPHA_THR", "0"))))
+    except ValueError:
+        return 0
+
+
+# Pixels with alpha below this are treated as background when finding the
+# subject's bounding box; 0 keeps any non-zero alpha.
+ALPHA_THRESHOLD = _alpha_threshold_from_env()
+
+
+def find_nontransparent_bbox(alpha: np.ndarray, threshold: int = ALPHA_THRESHOLD):
+    import numpy as np
+
+    if threshold > 1:
+        alpha = alpha >= threshold
+
+    if alpha.shape[1] % 8 == 0 and alpha.flags.c_contiguous:
+        # SWAR: test 8 alpha bytes at once as one uint64 word. OR-ing words is
+        # a byte-wise OR, so the reduced row still says which columns are set.
+        words = alpha.view(np.uint64)
+        nz_rows = words.any(axis=1)
+        if not nz_rows.any():
+            return None
+        y0 = int(nz_rows.argmax())
+        y1 = len(nz_rows) - 1 - int(nz_rows[::-1].argmax())
+        nz_cols = np.bitwise_or.reduce(words[y0 : y1 + 1], axis=0).view(np.uint8)
+    else:
+        # Other widths: pack the mask to one bit per pixel so the row and
+        # column reductions touch an eighth of the bytes.
+        packed = np.packbits(alpha, axis=1)
+        nz_rows = packed.any(axis=1)
+        if not nz_rows.any():
+            return None
+        y0 = int(nz_rows.argmax())
+        y1 = len(nz_rows) - 1 - int(nz_rows[::-1].argmax())
+        nz_cols = np.unpackbits(
+            np.bitwise_or.reduce(packed[y0 : y1 + 1], axis=0), count=alpha.shape[1]
+        )
+
+    nz_cols = nz_cols != 0
+    x0 = int(nz_cols.argmax())
+    x1 = len(nz_cols) - 1 - int(nz_cols[::-1].argmax())
     return x0, y0, x1, y1
 
 
 Size = Union[int, Tuple[int, int]]
 
+# (filename, data, content type) as accepted by requests' files= argument.
+UploadFile = Tuple[str, io.BytesIO, str]
+
+_RESAMPLE_FILTERS = {
+    "lanczos": "LANCZOS",
+    "bicubic": "BICUBIC",
+    "bilinear": "BILINEAR",
+}
+
+RESAMPLE = _RESAMPLE_FILTERS.get(
+    os.environ.get("REMOVEBG_SQUARE_RESAMPLE", "lanczos").strip().lower(),
+    "LANCZOS",
+)
+
+# Per-image work runs as a normalize -> upload -> compose pipeline. The upload
+# stage gets max_workers threads, the CPU-bound stages get this many each, and
+# the queues between them are bounded to keep memory flat on large folders.
+PIPELINE_CPU_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 4
+
+# Uploads are capped to this long edge; the output canvas is far smaller, so
+# anything beyond it is wasted upload bandwidth.
+MAX_UPLOAD_LONG_EDGE = 4096
+
+# Encoder settings per output extension: fast zlib for PNG (the files are small
+# flat-background product shots), lossless WebP.
+_SAVE_OPTIONS: dict[str, dict[str, Any]] = {
+    ".png": {"format": "PNG", "compress_level": 1},
+    ".webp": {"format": "WEBP", "lossless": True, "quality": 80, "method": 4},
+}
+
+# RAW files are developed at half resolution (2x2 binning, no demosaic) when
+# that still leaves at least this long edge, well above any preset canvas.
+RAW_HALF_SIZE_MIN_LONG_EDGE = 2048
+
+# Large downscales first box-reduce by an integer factor, then run RESAMPLE on
+# an image at most REDUCING_GAP times the target size.
+REDUCING_GAP = 2.0
+
+
+# Per-thread RGB canvas reused across images of the same size. Safe because
+# Image.fromarray copies 3-channel data instead of sharing the buffer.
+_CANVAS = threading.local()
+
+
+def _white_canvas(out_w: int, out_h: int) -> np.ndarray:
+    import numpy as np
+
+    canvas = getattr(_CANVAS, "buf", None)
+    if canvas is None or canvas.shape != (out_h, out_w, 3):
+        canvas = np.full((out_h, out_w, 3), 255, dtype=np.uint8)
+        _CANVAS.buf = canvas
+    else:
+        canvas.fill(255)
+    return canvas
+
+
+@functools.lru_cache(maxsize=None)
+def _load_cv2():
+    try:
+        import cv2
+    except ImportError:
+        return None
+    cv2.setNumThreads(os.cpu_count() or 1)
+    return cv2
+
+
+def _paste_premultiplied_cv2(
+    cv2,
+    rgba: np.ndarray,
+    canvas: np.ndarray,
+    x: int,
+    y: int,
+    new_w: int,
+    new_h: int,
+    *,
+    shrink: bool,
+) -> None:
+    import numpy as np
+
+    # Resample premultiplied colour so fully transparent pixels can't bleed
+    # into the subject's edges; compositing over white is then rgb + 255 - a.
+    a = rgba[..., 3:4].astype(np.uint16)
+    premul = np.empty_like(rgba)
+    premul[..., :3] = (rgba[..., :3] * a + 127) // 255
+    premul[..., 3:] = rgba[..., 3:]
+
+    interp = cv2.INTER_AREA if shrink else cv2.INTER_LANCZOS4
+    resized = cv2.resize(premul, (new_w, new_h), interpolation=interp)
+
+    rgb = resized[..., :3].astype(np.uint16)
+    rgb += 255 - resized[..., 3:4]
+    canvas[y : y + new_h, x : x + new_w] = np.minimum(rgb, 255)
+
 
 def paste_on_white_canvas(
     img: Image.Image,
@@ -48,6 +188,9 @@ def paste_on_white_canvas(
     top: int,
     bottom: int,
 ) -> Image.Image:
+    import numpy as np
+    from PIL import Image
+
     left = int(left)
     right = int(right)
     top = int(top)
@@ -58,16 +201,18 @@ def paste_on_white_canvas(
     else:
         out_w, out_h = int(out_size[0]), int(out_size[1])
 
-    rgba = pil_to_rgba(img)
-    arr = np.array(rgba)
-    alpha = arr[:, :, 3]
+    # Only the alpha plane is needed for the bbox; the RGBA conversion (if any)
+    # is deferred until after the crop.
+    if "A" not in img.getbands():
+        img = pil_to_rgba(img)
+    alpha = np.asarray(img.getchannel("A"))
 
     bbox = find_nontransparent_bbox(alpha)
     if bbox is None:
         return Image.new("RGB", (out_w, out_h), (255, 255, 255))
 
     x0, y0, x1, y1 = bbox
-    cropped = rgba.crop((x0, y0, x1 + 1, y1 + 1))
+    cropped = pil_to_rgba(img.crop((x0, y0, x1 + 1, y1 + 1)))
     cw, ch = cropped.size
     if cw <= 0 or ch <= 0:
         return Image.new("RGB", (out_w, out_h), (255, 255, 255))
@@ -84,45 +229,104 @@ def paste_on_white_canvas(
     new_w = min(new_w, inner_w)
     new_h = min(new_h, inner_h)
 
-    resized = cropped.resize((new_w, new_h), resample=Image.LANCZOS)
-
     x = left + (inner_w - new_w) // 2
     y = top + (inner_h - new_h) // 2
 
     x = max(left, min(x, out_w - right - new_w))
     y = max(top, min(y, out_h - bottom - new_h))
 
-    temp = Image.new("RGBA", (out_w, out_h), (255, 255, 255, 255))
-    temp.alpha_composite(resized, (x, y))
-    return temp.convert("RGB")
+    canvas = _white_canvas(out_w, out_h)
+
+    cv2 = _load_cv2()
+    if cv2 is not None:
+        _paste_premultiplied_cv2(
+            cv2, np.asarray(cropped), canvas, x, y, new_w, new_h, shrink=scale < 1.0
+        )
+        return Image.fromarray(canvas, "RGB")
+
+    resized = cropped.resize(
+        (new_w, new_h),
+        resample=getattr(Image, RESAMPLE),
+        reducing_gap=REDUCING_GAP,
+    )
+
+    from removebg_square._kernels import composite_on_white
+
+    src = np.asarray(resized, dtype=np.uint8)
+    if composite_on_white is not None:
+        composite_on_white(canvas, src, x, y)
+    else:
+        a = src[..., 3:4].astype(np.uint16)
+        canvas[y : y + new_h, x : x + new_w] = (
+            (src[..., :3] * a + 255 * (255 - a) + 127) // 255
+        ).astype(np.uint8)
+    return Image.fromarray(canvas, "RGB")
 
 
 def raw_to_rgb_pil(input_path: Path) -> Image.Image:
+    import rawpy
+    from PIL import Image
+
     with rawpy.imread(str(input_path)) as raw:
+        long_edge = max(raw.sizes.width, raw.sizes.height)
         rgb = raw.postprocess(
             use_camera_wb=True,
             no_auto_bright=True,
             output_bps=8,
+            half_size=long_edge // 2 >= RAW_HALF_SIZE_MIN_LONG_EDGE,
         )
     return Image.fromarray(rgb, mode="RGB")
 
 
-def normalize_input_to_png(input_path: Path, out_path: Path) -> Path:
-    ext = input_path.suffix.lower()
+def _upload_size(size: Tuple[int, int]) -> Tuple[int, int]:
+    w, h = size
+    long_edge = max(w, h)
+    if long_edge <= MAX_UPLOAD_LONG_EDGE:
+        return w, h
+    scale = MAX_UPLOAD_LONG_EDGE / long_edge
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
 
-    if ext in [".png", ".jpeg", ".jpg"]:
-        return input_path
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
 
-    out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    if ext in [".nef", ".arw", ".cr3"]:
-        img = raw_to_rgb_pil(input_path)
-        img.save(out_path, format="JPG")
-        return out_path
+RAW_SUFFIXES = frozenset({".nef", ".arw", ".cr3"})
+PASSTHROUGH_SUFFIXES = frozenset({".png", ".jpeg", ".jpg"})
 
-    img = Image.open(input_path).convert("RGB")
-    img.save(out_path, format="JPG")
-    return out_path
+
+def normalize_input_for_upload(input_path: Path) -> Optional[UploadFile]:
+    from PIL import Image, ImageOps
+
+    ext = input_path.suffix.lower()
+
+    if ext in RAW_SUFFIXES:
+        img = raw_to_rgb_pil(input_path)
+    else:
+        img = Image.open(input_path)
+        target = _upload_size(img.size)
+        if ext in PASSTHROUGH_SUFFIXES and target == img.size:
+            img.close()
+            return None
+        # JPEG only: let libjpeg decode at a reduced DCT scale close to target.
+        img.draft("RGB", target)
+        img = ImageOps.exif_transpose(img)
+
+    target = _upload_size(img.size)
+    if target != img.size:
+        img = img.resize(target, resample=Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+    buf = io.BytesIO()
+    if _has_alpha(img):
+        img.save(buf, format="PNG", compress_level=1)
+        name, mime = f"{input_path.stem}.png", "image/png"
+    else:
+        img.convert("RGB").save(buf, format="JPEG", quality=92, subsampling=0)
+        name, mime = f"{input_path.stem}.jpg", "image/jpeg"
+    buf.seek(0)
+    return name, buf, mime
 
 
 def _copy_to_bad_folder(
@@ -148,27 +352,76 @@ def _copy_to_bad_folder(
     return dst
 
 
+REMOVEBG_URL = "https://api.remove.bg/v1.0/removebg"
+
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry = Retry(
+                total=3,
+                read=0,
+                backoff_factor=0.3,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({"POST"}),
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            session.mount(
+                "https://",
+                HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry),
+            )
+            _SESSION = session
+        return _SESSION
+
+
+def close_session() -> None:
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is not None:
+            _SESSION.close()
+            _SESSION = None
+
+
 def removebg_via_requests(
     input_path: Path,
-    out_dir: Path,
+    out_dir: Optional[Path],
     api_key: str,
     bad_dir: Path,
     size: str = "auto",
     timeout_s: int = 60,
-) -> tuple[Optional[Path], Optional[str], Optional[str]]:
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / f"{input_path.stem}.jpg"
+    out_stem: Optional[str] = None,
+    upload: Optional[UploadFile] = None,
+) -> tuple[Optional[io.BytesIO], Optional[str], Optional[str]]:
+    import requests
 
-    url = "https://api.remove.bg/v1.0/removebg"
     headers = {"X-Api-Key": api_key}
+    data = {"size": size, "format": "png"}
+
+    def _post(image_file: Any) -> requests.Response:
+        return _get_session().post(
+            REMOVEBG_URL,
+            headers=headers,
+            files={"image_file": image_file},
+            data=data,
+            timeout=timeout_s,
+            stream=True,
+        )
 
     try:
-        with input_path.open("rb") as f:
-            files = {"image_file": f}
-            data = {"size": size}
-            resp = requests.post(
-                url, headers=headers, files=files, data=data, timeout=timeout_s
-            )
+        if upload is not None:
+            resp = _post(upload)
+        else:
+            with input_path.open("rb") as f:
+                resp = _post(f)
     except requests.RequestException as e:
         _copy_to_bad_folder(
             src=input_path,
@@ -179,8 +432,26 @@ def removebg_via_requests(
         return None, "removebg_request_failed", str(e)
 
     if resp.status_code == 200:
-        out_path.write_bytes(resp.content)
-        return out_path, None, None
+        try:
+            blob = io.BytesIO()
+            for chunk in resp.iter_content(1 << 20):
+                blob.write(chunk)
+            blob.seek(0)
+            if out_dir is not None:
+                out_dir.mkdir(parents=True, exist_ok=True)
+                out_path = out_dir / f"{out_stem or input_path.stem}_rmbg.png"
+                out_path.write_bytes(blob.getbuffer())
+        except (OSError, requests.RequestException) as e:
+            _copy_to_bad_folder(
+                src=input_path,
+                bad_dir=bad_dir,
+                reason="remove.bg response download failed",
+                extra_text=str(e),
+            )
+            return None, "removebg_download_failed", str(e)
+        finally:
+            resp.close()
+        return blob, None, None
 
     if 400 <= resp.status_code <= 403:
         ct = resp.headers.get("Content-Type", "")
@@ -215,23 +486,81 @@ def removebg_via_requests(
     return None, f"removebg_http_{resp.status_code}", extra
 
 
+INPUT_SUFFIXES = frozenset(
+    {
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".webp",
+        ".bmp",
+        ".tif",
+        ".tiff",
+        ".nef",
+        ".arw",
+        ".cr3",
+    }
+)
+
+
+def _result_cache_path(cache_dir: Path, path: Path, remove_size: str) -> Path:
+    st = path.stat()
+    key = f"{path.resolve()}\0{st.st_size}\0{st.st_mtime_ns}\0{remove_size}"
+    return cache_dir / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.png"
+
+
+def _result_cache_max_bytes_from_env() -> int:
+    try:
+        mb = int(os.environ.get("REMOVEBG_SQUARE_CACHE_MAX_MB", "1024"))
+    except ValueError:
+        mb = 1024
+    return max(0, mb) * 1024 * 1024
+
+
+# The opt-in remove.bg result cache is trimmed to this size after each run,
+# least recently used entries first.
+RESULT_CACHE_MAX_BYTES = _result_cache_max_bytes_from_env()
+
+
+def _prune_result_cache(cache_dir: Path, max_bytes: int) -> None:
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".png") and entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(entry_path)
+        except OSError:
+            continue
+        total -= size
+
+
+def _write_result_cache(cache_file: Path, blob: io.BytesIO) -> None:
+    tmp = cache_file.with_name(f"{cache_file.name}.{threading.get_ident()}.tmp")
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(blob.getbuffer())
+        tmp.replace(cache_file)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+
+
 def iter_input_files(input_dir: Path) -> list[Path]:
-    patterns = [
-        "*.png",
-        "*.jpg",
-        "*.jpeg",
-        "*.webp",
-        "*.bmp",
-        "*.tif",
-        "*.tiff",
-        "*.nef",
-        "*.arw",
-        "*.cr3",
-    ]
-    files: list[Path] = []
-    for pat in patterns:
-        files.extend(input_dir.glob(pat))
-    return sorted(set(files))
+    with os.scandir(input_dir) as it:
+        return sorted(
+            Path(entry.path)
+            for entry in it
+            if entry.is_file()
+            and os.path.splitext(entry.name)[1].lower() in INPUT_SUFFIXES
+        )
 
 
 def process_folder(
@@ -249,7 +578,12 @@ def process_folder(
     embed_png_xmp: bool = True,
     also_write_xmp_sidecar: bool = False,
     run_id: str = "unknown",
+    max_workers: int = 8,
+    keep_tmp: bool = False,
+    cache_dir: Optional[Path] = None,
 ) -> ProcessResult:
+    from PIL import Image
+
     output_dir.mkdir(parents=True, exist_ok=True)
     input_dir.mkdir(parents=True, exist_ok=True)
 
@@ -269,104 +603,149 @@ def process_folder(
         )
 
     temp_dir = output_dir / "_tmp_removebg"
-    temp_dir.mkdir(parents=True, exist_ok=True)
 
     bad_dir = output_dir / "bad"
-    written: list[Path] = []
-
-    processed = 0
-    unprocessed = 0
-
-    processed_files: list[dict[str, Any]] = []
-    unprocessed_files: list[dict[str, Any]] = []
+    total = len(files)
+    log_lock = threading.Lock()
+
+    progress = None
+    if sys.stdout.isatty():
+        from rich.progress import (
+            BarColumn,
+            MofNCompleteColumn,
+            Progress,
+            SpinnerColumn,
+            TextColumn,
+            TimeRemainingColumn,
+        )
 
-    def _record_processed(*, src: str, dest: str, seconds: float) -> None:
-        processed_files.append(
-            {
-                "src": src,
-                "dest": dest,
-                "seconds": float(seconds),
-            }
+        progress = Progress(
+            SpinnerColumn(),
+            TextColumn("{task.description}"),
+            BarColumn(),
+            MofNCompleteColumn(),
+            TimeRemainingColumn(),
         )
+        task = progress.add_task("Processing", total=total)
+
+    def _log(msg: str, *, detail: bool = False) -> None:
+        if progress is not None:
+            if not detail:
+                progress.console.log(msg, markup=False, highlight=False)
+            return
+        with log_lock:
+            print(msg)
 
-    def _record_unprocessed(
+    def _unprocessed(
         *,
         src: str,
         dest: Optional[str],
         reason: str,
         error: Optional[str],
         seconds: float,
-    ) -> None:
-        unprocessed_files.append(
-            {
-                "src": src,
-                "dest": dest or "",
-                "reason": reason,
-                "error": (error or "")[:2000],
-                "seconds": float(seconds),
-            }
-        )
-
-    for idx, path in enumerate(files, start=1):
-        img_t0 = time.time()
-        print(f"[{idx}/{len(files)}] Processing: {path}")
+    ) -> tuple[None, dict[str, Any]]:
+        return None, {
+            "src": src,
+            "dest": dest or "",
+            "reason": reason,
+            "error": (error or "")[:2000],
+            "seconds": float(seconds),
+        }
+
+    def _normalize(idx: int, path: Path, img_t0: float, _: Any) -> tuple[bool, Any]:
+        tag = f"[{idx}/{total}] {path.name}"
+        _log(f"{tag}: Processing {path}", detail=True)
+
+        cache_file = None
+        if cache_dir is not None:
+            try:
+                cache_file = _result_cache_path(cache_dir, path, remove_size)
+                cached = io.BytesIO(cache_file.read_bytes())
+            except OSError:
+                pass
+            else:
+                try:
+                    os.utime(cache_file)
+                except OSError:
+                    pass
+                _log(f"{tag}: using cached remove.bg result", detail=True)
+                return False, (None, cached, cache_file)
 
-        # 1) Normalize
         try:
-            normalized = normalize_input_to_png(
-                path, temp_dir / f"{path.stem}_normalized.png"
-            )
+            upload = normalize_input_for_upload(path)
+            if upload is not None and keep_tmp:
+                temp_dir.mkdir(parents=True, exist_ok=True)
+                (temp_dir / f"{idx}_{upload[0]}").write_bytes(upload[1].getbuffer())
         except Exception as e:
             bad_copy = _copy_to_bad_folder(
                 path, bad_dir, "Normalize/open failed (skipped)", str(e)
             )
-            print("  -> Skipped (normalize failed)")
-            unprocessed += 1
-            _record_unprocessed(
+            _log(f"{tag} -> Skipped (normalize failed)")
+            return True, _unprocessed(
                 src=path.name,
                 dest=(str(bad_copy.name) if bad_copy else ""),
                 reason="normalize_failed",
                 error=str(e),
                 seconds=time.time() - img_t0,
             )
-            continue
-
-        remove_png_path, fail_reason, fail_extra = removebg_via_requests(
-            normalized,
-            temp_dir,
+        return False, (upload, None, cache_file)
+
+    def _upload(
+        idx: int,
+        path: Path,
+        img_t0: float,
+        payload: tuple[Optional[UploadFile], Optional[io.BytesIO], Optional[Path]],
+    ) -> tuple[bool, Any]:
+        upload, cached, cache_file = payload
+        if cached is not None:
+            return False, cached
+
+        tag = f"[{idx}/{total}] {path.name}"
+        removed_blob, fail_reason, fail_extra = removebg_via_requests(
+            path,
+            temp_dir if keep_tmp else None,
             api_key,
             bad_dir=bad_dir,
             size=remove_size,
+            out_stem=f"{idx}_{path.stem}",
+            upload=upload,
         )
 
-        if remove_png_path is None:
-            print("  -> Skipped (remove.bg 400–403 or request failure; copied to bad/)")
-            unprocessed += 1
-            _record_unprocessed(
+        if removed_blob is None:
+            _log(
+                f"{tag} -> Skipped (remove.bg 400–403 or request failure; copied to bad/)"
+            )
+            return True, _unprocessed(
                 src=path.name,
                 dest=str((bad_dir / path.name).name),
                 reason=fail_reason or "removebg_failed",
                 error=fail_extra,
                 seconds=time.time() - img_t0,
             )
-            continue
 
+        if cache_file is not None:
+            _write_result_cache(cache_file, removed_blob)
+        return False, removed_blob
+
+    def _compose(
+        idx: int, path: Path, img_t0: float, removed_blob: io.BytesIO
+    ) -> tuple[bool, Any]:
+        tag = f"[{idx}/{total}] {path.name}"
         try:
-            removed = Image.open(remove_png_path).convert("RGBA")
+            removed = Image.open(removed_blob)
+            removed.load()
         except Exception as e:
             bad_copy = _copy_to_bad_folder(
                 path, bad_dir, "Failed to open remove.bg output (skipped)", str(e)
             )
-            print("  -> Skipped (could not open remove.bg output)")
-            unprocessed += 1
-            _record_unprocessed(
+            _log(f"{tag} -> Skipped (could not open remove.bg output)")
+            return True, _unprocessed(
                 src=path.name,
                 dest=(str(bad_copy.name) if bad_copy else ""),
                 reason="open_removebg_output_failed",
                 error=str(e),
                 seconds=time.time() - img_t0,
             )
-            continue
 
         try:
             out_img = paste_on_white_canvas(
@@ -381,37 +760,30 @@ def process_folder(
             bad_copy = _copy_to_bad_folder(
                 path, bad_dir, "Canvas/paste failed (skipped)", str(e)
             )
-            print("  -> Skipped (paste_on_white_canvas failed)")
-            unprocessed += 1
-            _record_unprocessed(
+            _log(f"{tag} -> Skipped (paste_on_white_canvas failed)")
+            return True, _unprocessed(
                 src=path.name,
                 dest=(str(bad_copy.name) if bad_copy else ""),
                 reason="canvas_paste_failed",
                 error=str(e),
                 seconds=time.time() - img_t0,
             )
-            continue
 
         out_path = output_dir / f"{path.stem}{out_ext}"
         try:
-            out_img.save(out_path)
+            out_img.save(out_path, **_SAVE_OPTIONS.get(out_ext.lower(), {}))
         except Exception as e:
             bad_copy = _copy_to_bad_folder(
                 path, bad_dir, "Save output failed (skipped)", str(e)
             )
-            print("  -> Skipped (save failed)")
-            unprocessed += 1
-            _record_unprocessed(
+            _log(f"{tag} -> Skipped (save failed)")
+            return True, _unprocessed(
                 src=path.name,
                 dest=(str(bad_copy.name) if bad_copy else ""),
                 reason="save_failed",
                 error=str(e),
                 seconds=time.time() - img_t0,
             )
-            continue
-
-        written.append(out_path)
-        processed += 1
 
         tagged = write_processed_tags(
             out_path,
@@ -421,15 +793,109 @@ def process_folder(
             also_write_sidecar=also_write_xmp_sidecar,
         )
         if tagged:
-            print(f"  [XMP] tagged: {out_path.name} (ProcessedWith:{xmp_tool})")
+            _log(
+                f"{tag} [XMP] tagged: {out_path.name} (ProcessedWith:{xmp_tool})",
+                detail=True,
+            )
         else:
-            print(f"  [XMP] FAILED to tag: {out_path.name}")
+            _log(f"{tag} [XMP] FAILED to tag: {out_path.name}")
 
-        print(f"  Wrote: {out_path}")
         sec = time.time() - img_t0
-        print(f"  Per-image time: {sec:.2f}s")
+        _log(f"{tag} Wrote: {out_path} ({sec:.2f}s)", detail=True)
+
+        return True, (
+            out_path,
+            {"src": path.name, "dest": out_path.name, "seconds": sec},
+        )
+
+    results: list[Optional[tuple[Optional[Path], dict[str, Any]]]] = [None] * total
+    errors: list[Exception] = []
+
+    def _stage(fn, inbox: queue.Queue, outbox: Optional[queue.Queue]) -> None:
+        while True:
+            job = inbox.get()
+            if job is None:
+                return
+            if errors:
+                continue
+            idx, path, img_t0, payload = job
+            try:
+                done, value = fn(idx, path, img_t0, payload)
+            except Exception as e:
+                with log_lock:
+                    errors.append(e)
+                continue
+            if done:
+                results[idx - 1] = value
+                if progress is not None:
+                    progress.advance(task)
+            elif outbox is not None:
+                outbox.put((idx, path, img_t0, value))
+
+    io_workers = max(1, int(max_workers))
+    cpu_workers = min(PIPELINE_CPU_WORKERS, io_workers)
+    queues = [queue.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in range(3)]
+    stages = [
+        (_normalize, queues[0], queues[1], cpu_workers),
+        (_upload, queues[1], queues[2], io_workers),
+        (_compose, queues[2], None, cpu_workers),
+    ]
+    threads = [
+        [
+            threading.Thread(target=_stage, args=(fn, inbox, outbox), daemon=True)
+            for _ in range(n)
+        ]
+        for fn, inbox, outbox, n in stages
+    ]
+
+    if progress is not None:
+        progress.start()
+    try:
+        for group in threads:
+            for t in group:
+                t.start()
+
+        for idx, path in enumerate(files, start=1):
+            if errors:
+                break
+            queues[0].put((idx, path, time.time(), None))
+
+        for (_, inbox, _, n), group in zip(stages, threads):
+            for _ in range(n):
+                inbox.put(None)
+            for t in group:
+                t.join()
+    finally:
+        close_session()
+        if progress is not None:
+            progress.stop()
+        if cache_dir is not None:
+            _prune_result_cache(cache_dir, RESULT_CACHE_MAX_BYTES)
+        if not keep_tmp:
+            try:
+                temp_dir.rmdir()
+            except OSError:
+                pass
+
+    if errors:
+        raise errors[0]
+
+    written: list[Path] = []
+    processed_files: list[dict[str, Any]] = []
+    unprocessed_files: list[dict[str, Any]] = []
+
+    for res in results:
+        if res is None:
+            continue
+        out_path, record = res
+        if out_path is None:
+            unprocessed_files.append(record)
+        else:
+            written.append(out_path)
+            processed_files.append(record)
 
-        _record_processed(src=path.name, dest=out_path.name, seconds=sec)
+    processed = len(written)
+    unprocessed = len(unprocessed_files)
 
     print(
         f"[TOTAL] Finished {processed}/{len(files)} images in {time.time() - total_t0:.2f}s"
@@ -1,11 +1,25 @@
 from __future__ import annotations
 
-import struct
+import copy
+import functools
+import os
+import re
+import stat
+import tempfile
 import zlib
-import xml.etree.ElementTree as ET
 from datetime import date as _date
 from pathlib import Path
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
+from xml.sax.saxutils import escape as _xml_escape
+
+try:
+    from lxml import etree as ET
+
+    _XML_PARSER = ET.XMLParser(resolve_entities=False, huge_tree=False)
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+    _XML_PARSER = None
 
 DEFAULT_PROCESS_TOOL = "removebg-square-cli"
 
@@ -27,60 +41,67 @@ _ensure_ns("x", _NS["x"])
 _ensure_ns("rdf", _NS["rdf"])
 _ensure_ns("dc", _NS["dc"])
 
+_TAG_XMPMETA = f"{{{_NS['x']}}}xmpmeta"
+_TAG_RDF = f"{{{_NS['rdf']}}}RDF"
+_TAG_DESC = f"{{{_NS['rdf']}}}Description"
+_TAG_BAG = f"{{{_NS['rdf']}}}Bag"
+_TAG_ALT = f"{{{_NS['rdf']}}}Alt"
+_TAG_LI = f"{{{_NS['rdf']}}}li"
+_TAG_DC_SUBJECT = f"{{{_NS['dc']}}}subject"
+_TAG_DC_DESCRIPTION = f"{{{_NS['dc']}}}description"
+_XML_LANG_KEY = "{http://www.w3.org/XML/1998/namespace}lang"
+
 
 def _minimal_xmp_packet_root() -> ET.Element:
-    xmpmeta = ET.Element(f"{{{_NS['x']}}}xmpmeta")
-    rdf = ET.SubElement(xmpmeta, f"{{{_NS['rdf']}}}RDF")
-    ET.SubElement(rdf, f"{{{_NS['rdf']}}}Description")
-    return xmpmeta
+    return _element_chain(_TAG_XMPMETA, _TAG_RDF, _TAG_DESC)
 
 
-def _get_or_create_rdf_description(xmpmeta_root: ET.Element) -> ET.Element:
-    rdf = None
-    for el in xmpmeta_root.iter():
-        if el.tag == f"{{{_NS['rdf']}}}RDF":
-            rdf = el
-            break
-    if rdf is None:
-        rdf = ET.SubElement(xmpmeta_root, f"{{{_NS['rdf']}}}RDF")
+def _element_chain(*tags: str) -> ET.Element:
+    root = el = ET.Element(tags[0])
+    for tag in tags[1:]:
+        el = ET.SubElement(el, tag)
+    return root
+
 
-    for el in list(rdf):
-        if el.tag == f"{{{_NS['rdf']}}}Description":
-            return el
+_DC_SUBJECT_TEMPLATE = _element_chain(_TAG_DC_SUBJECT, _TAG_BAG, _TAG_LI)
+_DC_DESCRIPTION_TEMPLATE = _element_chain(_TAG_DC_DESCRIPTION, _TAG_ALT, _TAG_LI)
+_DC_DESCRIPTION_TEMPLATE[0][0].set(_XML_LANG_KEY, "x-default")
 
-    return ET.SubElement(rdf, f"{{{_NS['rdf']}}}Description")
 
+def _get_or_create_rdf_description(xmpmeta_root: ET.Element) -> ET.Element:
+    rdf = xmpmeta_root.find(_TAG_RDF)
+    if rdf is None:
+        rdf = next(xmpmeta_root.iter(_TAG_RDF), None)
+    if rdf is None:
+        rdf = ET.SubElement(xmpmeta_root, _TAG_RDF)
+
+    desc = rdf.find(_TAG_DESC)
+    if desc is not None:
+        return desc
 
-def _find_child(parent: ET.Element, ns: str, name: str) -> Optional[ET.Element]:
-    tag = f"{{{ns}}}{name}"
-    for ch in list(parent):
-        if ch.tag == tag:
-            return ch
-    return None
+    return ET.SubElement(rdf, _TAG_DESC)
 
 
 def _ensure_dc_subject_keyword(desc: ET.Element, keyword: str) -> bool:
     changed = False
 
-    dc_subject = _find_child(desc, _NS["dc"], "subject")
+    dc_subject = desc.find(_TAG_DC_SUBJECT)
     if dc_subject is None:
-        dc_subject = ET.SubElement(desc, f"{{{_NS['dc']}}}subject")
-        changed = True
+        dc_subject = copy.deepcopy(_DC_SUBJECT_TEMPLATE)
+        dc_subject[0][0].text = keyword
+        desc.append(dc_subject)
+        return True
 
-    bag = None
-    for ch in list(dc_subject):
-        if ch.tag == f"{{{_NS['rdf']}}}Bag":
-            bag = ch
-            break
+    bag = dc_subject.find(_TAG_BAG)
     if bag is None:
-        bag = ET.SubElement(dc_subject, f"{{{_NS['rdf']}}}Bag")
+        bag = ET.SubElement(dc_subject, _TAG_BAG)
         changed = True
 
-    for li in list(bag):
-        if li.tag == f"{{{_NS['rdf']}}}li" and (li.text or "").strip() == keyword:
+    for li in bag.iterfind(_TAG_LI):
+        if (li.text or "").strip() == keyword:
             return changed
 
-    li = ET.SubElement(bag, f"{{{_NS['rdf']}}}li")
+    li = ET.SubElement(bag, _TAG_LI)
     li.text = keyword
     return True
 
@@ -88,170 +109,223 @@ def _ensure_dc_subject_keyword(desc: ET.Element, keyword: str) -> bool:
 def _ensure_dc_description_xdefault(desc: ET.Element, text: str) -> bool:
     changed = False
 
-    dc_desc = _find_child(desc, _NS["dc"], "description")
+    dc_desc = desc.find(_TAG_DC_DESCRIPTION)
     if dc_desc is None:
-        dc_desc = ET.SubElement(desc, f"{{{_NS['dc']}}}description")
-        changed = True
+        dc_desc = copy.deepcopy(_DC_DESCRIPTION_TEMPLATE)
+        dc_desc[0][0].text = text
+        desc.append(dc_desc)
+        return True
 
-    alt = None
-    for ch in list(dc_desc):
-        if ch.tag == f"{{{_NS['rdf']}}}Alt":
-            alt = ch
-            break
+    alt = dc_desc.find(_TAG_ALT)
     if alt is None:
-        alt = ET.SubElement(dc_desc, f"{{{_NS['rdf']}}}Alt")
+        alt = ET.SubElement(dc_desc, _TAG_ALT)
         changed = True
 
-    xml_lang_key = "{http://www.w3.org/XML/1998/namespace}lang"
-    for li in list(alt):
-        if li.tag != f"{{{_NS['rdf']}}}li":
-            continue
-        lang = (li.attrib.get(xml_lang_key, "") or "").strip().lower()
-        if lang == "x-default":
+    for li in alt.iterfind(_TAG_LI):
+        lang = li.get(_XML_LANG_KEY) or ""
+        if lang == "x-default" or lang.strip().lower() == "x-default":
             if (li.text or "") == text:
                 return changed
             li.text = text
             return True
 
-    li = ET.SubElement(alt, f"{{{_NS['rdf']}}}li")
-    li.set(xml_lang_key, "x-default")
+    li = ET.SubElement(alt, _TAG_LI)
+    li.set(_XML_LANG_KEY, "x-default")
     li.text = text
     return True
 
 
-def _decode_xml_bytes(xmp_xml_bytes: bytes) -> Optional[str]:
-    if not xmp_xml_bytes:
+def _parse_xml(xmp_xml_bytes: bytes) -> Optional[ET.Element]:
+    try:
+        return ET.fromstring(xmp_xml_bytes, _XML_PARSER)
+    except Exception:
+        pass
+    try:
+        txt = xmp_xml_bytes.decode("utf-8-sig", errors="replace")
+        return ET.fromstring(txt.encode("utf-8"), _XML_PARSER)
+    except Exception:
         return None
-    for enc in ("utf-8", "utf-8-sig", "latin-1"):
-        try:
-            return xmp_xml_bytes.decode(enc, errors="replace")
-        except Exception:
-            continue
-    return None
 
 
 def _parse_or_create_xmpmeta_root(xmp_xml_bytes: Optional[bytes]) -> ET.Element:
-    if xmp_xml_bytes:
-        txt = _decode_xml_bytes(xmp_xml_bytes)
-        if txt:
-            try:
-                root = ET.fromstring(txt)
-                if root.tag.endswith("xmpmeta"):
-                    return root
-                for el in root.iter():
-                    if el.tag.endswith("xmpmeta"):
-                        return el
-            except Exception:
-                pass
+    root = _parse_xml(xmp_xml_bytes) if xmp_xml_bytes else None
+    if root is not None:
+        if root.tag.endswith("xmpmeta"):
+            return root
+        for el in root.iter():
+            if isinstance(el.tag, str) and el.tag.endswith("xmpmeta"):
+                return el
     return _minimal_xmp_packet_root()
 
 
 def _serialize_xmpmeta(root: ET.Element) -> bytes:
+    if _XML_PARSER is not None:
+        ET.cleanup_namespaces(root, top_nsmap=_NS)
     return ET.tostring(root, encoding="utf-8", xml_declaration=True)
 
 
+_RDF_DESC_OPEN_RE = re.compile(rb"<rdf:Description(?=[\s/>])[^>]*>")
+_RDF_DESC_CLOSE = b"</rdf:Description>"
+
+
+@functools.lru_cache(maxsize=16)
+def _processed_tag_patterns(
+    tool: str, processed_date: str
+) -> Tuple[re.Pattern, re.Pattern]:
+    keyword = re.escape(_xml_escape(f"ProcessedWith:{tool}").encode())
+    desc_text = re.escape(
+        _xml_escape(f"Processed by {tool} on {processed_date}").encode()
+    )
+    return (
+        re.compile(
+            rb"<dc:subject(?:\s[^>]*)?>\s*<rdf:Bag(?:\s[^>]*)?>"
+            rb"(?:(?!</rdf:Bag>).)*?"
+            rb"<rdf:li(?:\s[^>]*)?>\s*" + keyword + rb"\s*</rdf:li>",
+            re.DOTALL,
+        ),
+        re.compile(
+            rb"<dc:description(?:\s[^>]*)?>\s*<rdf:Alt(?:\s[^>]*)?>"
+            rb"(?:(?!</rdf:Alt>).)*?"
+            rb"<rdf:li\s[^>]*xml:lang=([\"'])x-default\1[^>]*>"
+            + desc_text
+            + rb"</rdf:li>",
+            re.DOTALL,
+        ),
+    )
+
+
+def _has_processed_tags(xmp: bytes, tool: str, processed_date: str) -> bool:
+    m = _RDF_DESC_OPEN_RE.search(xmp)
+    if m is None or m.group().endswith(b"/>"):
+        return False
+    end = xmp.find(_RDF_DESC_CLOSE, m.end())
+    if end == -1:
+        return False
+    keyword_re, desc_re = _processed_tag_patterns(tool, processed_date)
+    return (
+        keyword_re.search(xmp, m.end(), end) is not None
+        and desc_re.search(xmp, m.end(), end) is not None
+    )
+
+
 def _make_updated_xmp_packet(
     existing_xmp: Optional[bytes], *, tool: str, processed_date: str
-) -> bytes:
+) -> Optional[bytes]:
     keyword = f"ProcessedWith:{tool}"
     desc_text = f"Processed by {tool} on {processed_date}"
 
+    if existing_xmp and _has_processed_tags(existing_xmp, tool, processed_date):
+        return None
+
     root = _parse_or_create_xmpmeta_root(existing_xmp)
     rdf_desc = _get_or_create_rdf_description(root)
 
-    _ensure_dc_subject_keyword(rdf_desc, keyword)
-    _ensure_dc_description_xdefault(rdf_desc, desc_text)
+    changed = _ensure_dc_subject_keyword(rdf_desc, keyword)
+    changed = _ensure_dc_description_xdefault(rdf_desc, desc_text) or changed
+    if not changed:
+        return None
 
     return _serialize_xmpmeta(root)
 
 
 _PNG_SIG = b"\x89PNG\r\n\x1a\n"
 _XMP_ITXT_KEYWORD = b"XML:com.adobe.xmp"
+assert 1 <= len(_XMP_ITXT_KEYWORD) <= 79
+_XMP_ITXT_PREFIX = _XMP_ITXT_KEYWORD + b"\x00"
+_COPY_BUFSIZE = 1 << 20
 
 
-def _iter_png_chunks(data: bytes):
-    if not data.startswith(_PNG_SIG):
-        return
+def _iter_png_chunks(f, size: int):
     i = len(_PNG_SIG)
-    n = len(data)
-    while i + 8 <= n:
-        if i + 8 > n:
-            return
-        length = struct.unpack(">I", data[i : i + 4])[0]
-        ctype = data[i + 4 : i + 8]
-        data_start = i + 8
-        data_end = data_start + length
-        crc_end = data_end + 4
-        chunk_start = i
-        chunk_end = crc_end
-        if crc_end > n:
+    while i + 8 <= size:
+        f.seek(i)
+        header = f.read(8)
+        length = int.from_bytes(header[:4], "big")
+        ctype = header[4:8]
+        chunk_end = i + 8 + length + 4
+        if chunk_end > size:
             return
-        yield (ctype, data_start, data_end, chunk_start, chunk_end)
+        yield (ctype, length, i, chunk_end)
         i = chunk_end
         if ctype == b"IEND":
             return
 
 
 def _build_png_chunk(chunk_type: bytes, payload: bytes) -> bytes:
-    length = struct.pack(">I", len(payload))
-    crc = zlib.crc32(chunk_type)
-    crc = zlib.crc32(payload, crc) & 0xFFFFFFFF
-    crc_bytes = struct.pack(">I", crc)
-    return length + chunk_type + payload + crc_bytes
+    length = len(payload).to_bytes(4, "big")
+    body = chunk_type + payload
+    crc_bytes = (zlib.crc32(body) & 0xFFFFFFFF).to_bytes(4, "big")
+    return b"".join((length, body, crc_bytes))
 
 
 def _build_png_itxt_xmp_chunk(xmp_packet: bytes) -> bytes:
     keyword = _XMP_ITXT_KEYWORD
-    if len(keyword) < 1 or len(keyword) > 79:
-        raise ValueError("Invalid iTXt keyword length")
-
     compression_flag = b"\x00"
     compression_method = b"\x00"
-    language_tag = b"" + b"\x00"
-    translated_keyword = b"" + b"\x00"
-
-    payload = (
-        keyword
-        + b"\x00"
-        + compression_flag
-        + compression_method
-        + language_tag
-        + translated_keyword
-        + xmp_packet
+    language_tag = b"\x00"
+    translated_keyword = b"\x00"
+
+    payload = b"".join(
+        (
+            keyword,
+            b"\x00",
+            compression_flag,
+            compression_method,
+            language_tag,
+            translated_keyword,
+            xmp_packet,
+        )
     )
     return _build_png_chunk(b"iTXt", payload)
 
 
-def _extract_png_itxt_xmp_packet(data: bytes) -> Optional[bytes]:
-    for ctype, ds, de, _, _ in _iter_png_chunks(data):
-        if ctype != b"iTXt":
-            continue
-        payload = data[ds:de]
-        nul = payload.find(b"\x00")
-        if nul <= 0:
-            continue
-        keyword = payload[:nul]
-        if keyword != _XMP_ITXT_KEYWORD:
-            continue
+def _extract_png_itxt_xmp_packet(rest: bytes) -> Optional[bytes]:
+    if len(rest) < 2:
+        return None
+
+    fields = rest[2:].split(b"\x00", 2)
+    if len(fields) < 3:
+        return None
+    return fields[2]
+
+
+def _scan_png_for_xmp(f, size: int):
+    for ctype, length, chunk_start, chunk_end in _iter_png_chunks(f, size):
+        if (
+            ctype == b"iTXt"
+            and length >= len(_XMP_ITXT_PREFIX)
+            and f.read(len(_XMP_ITXT_PREFIX)) == _XMP_ITXT_PREFIX
+        ):
+            rest = f.read(length - len(_XMP_ITXT_PREFIX))
+            return _extract_png_itxt_xmp_packet(rest), chunk_start, chunk_end
 
-        j = nul + 1
-        if j + 2 > len(payload):
-            continue
-        j += 2
+        if ctype == b"IEND":
+            return None, chunk_start, chunk_start
 
-        nul2 = payload.find(b"\x00", j)
-        if nul2 == -1:
-            continue
-        j = nul2 + 1
+    return None, None, None
 
-        nul3 = payload.find(b"\x00", j)
-        if nul3 == -1:
-            continue
-        j = nul3 + 1
 
-        return payload[j:] if j <= len(payload) else b""
+def _copy_range(src, dst, offset: int, count: int) -> None:
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        dst.flush()
+        try:
+            while count > 0:
+                n = copy_file_range(src.fileno(), dst.fileno(), count, offset)
+                if n == 0:
+                    break
+                offset += n
+                count -= n
+        except OSError:
+            pass
 
-    return None
+    src.seek(offset)
+    while count > 0:
+        buf = src.read(min(count, _COPY_BUFSIZE))
+        if not buf:
+            raise EOFError("PNG truncated while copying")
+        dst.write(buf)
+        count -= len(buf)
 
 
 def write_processed_xmp_embed_png(
@@ -266,55 +340,44 @@ def write_processed_xmp_embed_png(
 
     processed_date = processed_date or _date.today().isoformat()
 
+    tmp_name = None
     try:
-        data = p.read_bytes()
-    except Exception:
-        return False
-
-    if not data.startswith(_PNG_SIG):
-        return False
-
-    existing_xmp = _extract_png_itxt_xmp_packet(data)
-    new_xmp_packet = _make_updated_xmp_packet(
-        existing_xmp, tool=tool, processed_date=processed_date
-    )
-    new_itxt = _build_png_itxt_xmp_chunk(new_xmp_packet)
-
-    replace_start = None
-    replace_end = None
-    insert_at = None
-
-    for ctype, _, _, chunk_start, chunk_end in _iter_png_chunks(data):
-        if ctype == b"iTXt":
-            payload = data[chunk_start + 8 : chunk_end - 4]
-            nul = payload.find(b"\x00")
-            if nul > 0 and payload[:nul] == _XMP_ITXT_KEYWORD:
-                replace_start = chunk_start
-                replace_end = chunk_end
-                break
-
-        if ctype == b"IEND":
-            insert_at = chunk_start
-            break
-
-    if replace_start is not None and replace_end is not None:
-        new_data = data[:replace_start] + new_itxt + data[replace_end:]
-    else:
-        if insert_at is None:
-            return False
-        new_data = data[:insert_at] + new_itxt + data[insert_at:]
-
-    tmp = p.with_suffix(p.suffix + ".tmp")
-    try:
-        tmp.write_bytes(new_data)
-        tmp.replace(p)
+        with open(p, "rb") as src:
+            if src.read(len(_PNG_SIG)) != _PNG_SIG:
+                return False
+            st = os.fstat(src.fileno())
+
+            existing_xmp, cut_start, cut_end = _scan_png_for_xmp(src, st.st_size)
+            if cut_start is None:
+                return False
+
+            new_xmp_packet = _make_updated_xmp_packet(
+                existing_xmp, tool=tool, processed_date=processed_date
+            )
+            if new_xmp_packet is None:
+                return True
+            new_itxt = _build_png_itxt_xmp_chunk(new_xmp_packet)
+            if cut_end - cut_start == len(new_itxt):
+                src.seek(cut_start)
+                if src.read(len(new_itxt)) == new_itxt:
+                    return True
+
+            with tempfile.NamedTemporaryFile(
+                dir=p.parent, prefix=f"{p.name}.", suffix=".tmp", delete=False
+            ) as dst:
+                tmp_name = dst.name
+                _copy_range(src, dst, 0, cut_start)
+                dst.write(new_itxt)
+                _copy_range(src, dst, cut_end, st.st_size - cut_end)
+            os.chmod(tmp_name, stat.S_IMODE(st.st_mode))
+        os.replace(tmp_name, p)
         return True
     except Exception:
-        try:
-            if tmp.exists():
-                tmp.unlink()
-        except Exception:
-            pass
+        if tmp_name is not None:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
         return False
 
 
@@ -340,23 +403,14 @@ def write_processed_xmp_sidecar(
         except Exception:
             existing = None
 
-    root = _parse_or_create_xmpmeta_root(existing)
-    rdf_desc = _get_or_create_rdf_description(root)
-
-    changed = False
-    changed = _ensure_dc_subject_keyword(rdf_desc, f"ProcessedWith:{tool}") or changed
-    changed = (
-        _ensure_dc_description_xdefault(
-            rdf_desc, f"Processed by {tool} on {processed_date}"
-        )
-        or changed
+    packet = _make_updated_xmp_packet(
+        existing, tool=tool, processed_date=processed_date
     )
-
-    if not changed and sidecar.exists():
+    if packet is None or packet == existing:
         return True
 
     try:
-        sidecar.write_bytes(_serialize_xmpmeta(root))
+        sidecar.write_bytes(packet)
         return True
     except Exception:
         return False